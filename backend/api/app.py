@@ -1,12 +1,101 @@
 import os
+import sys
 import json
-import onnxruntime as ort
+import resource
+import tempfile
 import numpy as np
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from numpy_engine import NumpyEngine
+from profile_store import ProfileStore
+
+# "onnx" runs the ONNX Runtime sessions, "numpy" the pure-NumPy engine (onnxruntime is
+# never imported), "auto" uses NumPy for batches of at most NUMPY_ENGINE_MAX_BATCH rows
+INFERENCE_ENGINE = os.environ.get("TEMPFEEL_ENGINE", "onnx")
+NUMPY_ENGINE_MAX_BATCH = int(os.environ.get("TEMPFEEL_NUMPY_MAX_BATCH", "1"))
+
+if INFERENCE_ENGINE not in ("onnx", "numpy", "auto"):
+    raise RuntimeError(f"❌ CRITICAL ERROR: Unknown TEMPFEEL_ENGINE '{INFERENCE_ENGINE}', expected onnx, numpy or auto.")
+
+if INFERENCE_ENGINE != "numpy":
+    import onnxruntime as ort
+
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Dedup-Ratio"])
+
+# "low" tunes ORT for many small replicas (see README), "default" keeps ORT defaults
+MEMORY_PROFILE = os.environ.get("TEMPFEEL_MEMORY_PROFILE", "low")
+# Largest number of rows handed to a session in one run; bigger batches are chunked
+MAX_BATCH_SIZE = int(os.environ.get("TEMPFEEL_MAX_BATCH_SIZE", "256"))
+
+if MAX_BATCH_SIZE < 1:
+    raise RuntimeError(f"❌ CRITICAL ERROR: TEMPFEEL_MAX_BATCH_SIZE must be at least 1, got {MAX_BATCH_SIZE}.")
+
+# Diagnostic routes such as /debug/memory; off by default since every path is public on Vercel
+DEBUG_ENDPOINTS = os.environ.get("TEMPFEEL_DEBUG_ENDPOINTS", "0") == "1"
+
+# Run each model only on the unique rows of a batch; turn off for traffic that never repeats
+DEDUP = os.environ.get("TEMPFEEL_DEDUP", "1") == "1"
+
+# Per-user calibration of the feels classifier, learned from /feedback/feels
+USER_PROFILES = os.environ.get("TEMPFEEL_USER_PROFILES", "1") == "1"
+PROFILE_CAPACITY = int(os.environ.get("TEMPFEEL_PROFILE_CAPACITY", "100000"))
+PROFILE_SNAPSHOT_PATH = os.environ.get(
+    "TEMPFEEL_PROFILE_SNAPSHOT",
+    # Only the temp directory is writable on Vercel; the pid keeps workers on one host
+    # from loading and overwriting each other's snapshot. Set to "" to turn snapshots off
+    os.path.join(tempfile.gettempdir(), f"tempfeel_profiles_{os.getpid()}.npz")
+)
+PROFILE_SNAPSHOT_INTERVAL = int(os.environ.get("TEMPFEEL_PROFILE_SNAPSHOT_INTERVAL", "60"))
+MAX_USER_ID_LENGTH = 128
+
+if PROFILE_CAPACITY < 1:
+    raise RuntimeError(f"❌ CRITICAL ERROR: TEMPFEEL_PROFILE_CAPACITY must be at least 1, got {PROFILE_CAPACITY}.")
+
+session_memory = {}
+
+def get_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_mb()
+
+def get_peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def configure_memory_profile():
+    if MEMORY_PROFILE != "low":
+        return
+    # One arena in the shared ORT environment for every session, growing only by
+    # what each run actually requests instead of doubling
+    arena_cfg = ort.OrtArenaCfg({
+        "arena_extend_strategy": 1,  # kSameAsRequested
+        "initial_chunk_size_bytes": 64 * 1024,
+        "max_dead_bytes_per_chunk": 16 * 1024,
+    })
+    mem_info = ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT)
+    try:
+        ort.create_and_register_allocator(mem_info, arena_cfg)
+        print(f"✅ Registered shared ORT allocator for '{MEMORY_PROFILE}' memory profile")
+    except Exception as e:
+        print(f"❌ Error registering shared ORT allocator: {e}")
+
+def build_session_options():
+    options = ort.SessionOptions()
+    if MEMORY_PROFILE == "low":
+        options.add_session_config_entry("session.use_env_allocators", "1")
+        # Memory patterns pre-plan buffers per input shape; with tiny, varying
+        # batches they cost more than they save
+        options.enable_mem_pattern = False
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+    return options
 
 def get_model_path(onnx_filename, model_name=None):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -26,19 +115,16 @@ def get_model_path(onnx_filename, model_name=None):
 def load_onnx_model(onnx_filename, model_name=None):
     model_path = get_model_path(onnx_filename, model_name)
     try:
-        session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        rss_before = get_rss_mb()
+        session = ort.InferenceSession(model_path, sess_options=build_session_options(), providers=['CPUExecutionProvider'])
+        session_memory[onnx_filename] = {"load_mb": round(get_rss_mb() - rss_before, 2)}
         print(f"✅ Successfully loaded ONNX model: {onnx_filename}")
         return session
     except Exception as e:
         print(f"❌ Error loading ONNX model from '{model_path}': {e}")
         return None
 
-def load_classifier_model(model_name):
-    session = load_onnx_model("model.onnx", model_name=model_name)
-    if session is None:
-        print(f"❌ ERROR: Failed to load classifier model '{model_name}'")
-        return None, None
-
+def load_model_metadata(model_name):
     meta_path = get_model_path("model_meta.json", model_name)
     try:
         with open(meta_path, 'r') as f:
@@ -47,8 +133,24 @@ def load_classifier_model(model_name):
     except Exception as e:
         print(f"❌ Error loading metadata for model '{model_name}': {e}")
         metadata = None
-    
-    return session, metadata
+
+    return metadata
+
+def load_classifier_model(model_name):
+    session = load_onnx_model("model.onnx", model_name=model_name)
+    if session is None:
+        print(f"❌ ERROR: Failed to load classifier model '{model_name}'")
+    return session
+
+def load_numpy_engine(engine_filename):
+    engine_path = get_model_path(engine_filename)
+    try:
+        engine = NumpyEngine.load(engine_path, max_batch_size=MAX_BATCH_SIZE)
+        print(f"✅ Loaded NumPy engine: {engine_filename}")
+        return engine
+    except Exception as e:
+        print(f"❌ Error loading NumPy engine '{engine_filename}': {e}")
+        return None
 
 def load_scaler(scaler_filename):
     scaler_path = get_model_path(scaler_filename)
@@ -60,19 +162,120 @@ def load_scaler(scaler_filename):
         print(f"❌ Error loading scaler '{scaler_filename}': {e}")
         return None, None
 
-print("🔍 Loading models...")
+def run_session(session, input_name, X, onnx_filename=None):
+    """
+    Run a session over X in chunks of at most MAX_BATCH_SIZE rows. With debug
+    endpoints on, the largest RSS growth seen during a run of each session is
+    recorded in session_memory as run_mb.
+    """
+    if not DEBUG_ENDPOINTS or onnx_filename is None:
+        return run_session_chunks(session, input_name, X)
+
+    rss_before = get_rss_mb()
+    outputs = run_session_chunks(session, input_name, X)
+    stats = session_memory.setdefault(onnx_filename, {})
+    stats["run_mb"] = max(stats.get("run_mb", 0.0), round(get_rss_mb() - rss_before, 2))
+    return outputs
+
+def run_session_chunks(session, input_name, X):
+    if len(X) <= MAX_BATCH_SIZE:
+        return session.run(None, {input_name: X})
+
+    outputs = None
+    for start in range(0, len(X), MAX_BATCH_SIZE):
+        chunk_outputs = session.run(None, {input_name: X[start:start + MAX_BATCH_SIZE]})
+        if outputs is None:
+            outputs = [[] for _ in chunk_outputs]
+        for collected, output in zip(outputs, chunk_outputs):
+            collected.append(output)
+    # Labels come back as arrays, ZipMap probabilities as lists of dicts
+    return [np.concatenate(parts) if isinstance(parts[0], np.ndarray) else [row for part in parts for row in part]
+            for parts in outputs]
+
+class OnnxEngine:
+    """Runs the upper, lower and classifier ONNX sessions; same interface as NumpyEngine."""
+
+    name = "onnx"
+
+    def __init__(self, upper_session, lower_session, feels_session, class_labels):
+        self.upper_session = upper_session
+        self.lower_session = lower_session
+        self.feels_session = feels_session
+        self.upper_input_name = upper_session.get_inputs()[0].name
+        self.lower_input_name = lower_session.get_inputs()[0].name
+        self.feels_input_name = feels_session.get_inputs()[0].name
+        self.class_labels = class_labels
+        print(f"✅ Upper Model Input: {self.upper_input_name}, Shape: {upper_session.get_inputs()[0].shape}")
+        print(f"✅ Lower Model Input: {self.lower_input_name}, Shape: {lower_session.get_inputs()[0].shape}")
+
+    def encode_upper(self, X):
+        return run_session(self.upper_session, self.upper_input_name, X, "encoder_upper.onnx")[0]
+
+    def encode_lower(self, X):
+        return run_session(self.lower_session, self.lower_input_name, X, "pca_lower.onnx")[0]
 
-feels_model, feels_metadata = load_classifier_model('feels')
-upper_model = load_onnx_model("encoder_upper.onnx")
-lower_model = load_onnx_model("pca_lower.onnx")
+    def classify(self, X):
+        labels, zipmap = run_session(self.feels_session, self.feels_input_name, X, "model.onnx")
+        probabilities = np.array([[row[label] for label in self.class_labels] for row in zipmap], dtype=np.float32)
+        return labels, probabilities
 
+def select_engine(n_rows):
+    if numpy_engine is not None and (onnx_engine is None or n_rows <= NUMPY_ENGINE_MAX_BATCH):
+        return numpy_engine
+    return onnx_engine
+
+print(f"🔍 Loading models for '{INFERENCE_ENGINE}' engine...")
+
+feels_metadata = load_model_metadata('feels')
 upper_mean, upper_scale = load_scaler("scaler_upper.npz")
 lower_mean, lower_scale = load_scaler("scaler_lower.npz")
 
-if lower_model is None:
-    raise RuntimeError("❌ CRITICAL ERROR: lower_model failed to load. Check logs.")
+onnx_engine = None
+if INFERENCE_ENGINE != "numpy":
+    configure_memory_profile()
+    feels_model = load_classifier_model('feels')
+    upper_model = load_onnx_model("encoder_upper.onnx")
+    lower_model = load_onnx_model("pca_lower.onnx")
+
+    if lower_model is None:
+        raise RuntimeError("❌ CRITICAL ERROR: lower_model failed to load. Check logs.")
+
+    if feels_model is not None and upper_model is not None and feels_metadata is not None:
+        class_labels = sorted(int(label) for label in feels_metadata["class_mapping"])
+        onnx_engine = OnnxEngine(upper_model, lower_model, feels_model, class_labels)
+
+numpy_engine = None
+if INFERENCE_ENGINE != "onnx":
+    numpy_engine = load_numpy_engine("numpy_engine.npz")
+
+    if numpy_engine is None and INFERENCE_ENGINE == "numpy":
+        raise RuntimeError("❌ CRITICAL ERROR: NumPy engine failed to load. Run training/export_numpy_engine.py.")
+
+def load_profile_store(n_classes):
+    store = ProfileStore(
+        n_classes,
+        capacity=PROFILE_CAPACITY,
+        snapshot_path=PROFILE_SNAPSHOT_PATH,
+        snapshot_interval=PROFILE_SNAPSHOT_INTERVAL
+    )
+    if not PROFILE_SNAPSHOT_PATH:
+        return store
 
-print("✅ All models loaded successfully.")
+    if os.path.exists(PROFILE_SNAPSHOT_PATH):
+        try:
+            store.load()
+            print(f"✅ Loaded {len(store)} user profiles from {PROFILE_SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"❌ Error loading user profiles from '{PROFILE_SNAPSHOT_PATH}': {e}")
+    store.start_snapshots()
+    return store
+
+profile_store = None
+if USER_PROFILES and feels_metadata is not None:
+    profile_store = load_profile_store(len(feels_metadata["class_mapping"]))
+
+load_rss_mb = get_rss_mb()
+print(f"✅ All models loaded successfully. RSS: {load_rss_mb:.1f} MB")
 
 def prepare_features(instances, feature_names):
     X = np.zeros((len(instances), len(feature_names)), dtype=np.float32)
@@ -84,23 +287,51 @@ def prepare_features(instances, feature_names):
 def index_to_label(index, metadata):
     return metadata["class_mapping"].get(str(index), "Unknown")
 
-@app.route('/')
-def home():
-    return 'Hello, World!'
+def is_valid_user_id(user_id):
+    if isinstance(user_id, bool) or not isinstance(user_id, (str, int)):
+        return False
+    # Snapshots and the store keep every id; bound what one caller can make them hold
+    return 0 < len(str(user_id)) <= MAX_USER_ID_LENGTH
 
-@app.route("/predict/feels", methods=["POST"])
-def predict_feels():
-    if feels_model is None:
-        print("❌ No feels model loaded")
-        return jsonify({"error": "No feels model loaded"}), 503
+def label_to_class_index(value, class_labels, metadata):
+    """Maps a reported feels value (class label or its name) to a probability column."""
+    names = {name: int(label) for label, name in metadata["class_mapping"].items()}
+    if isinstance(value, str) and value in names:
+        label = names[value]
+    elif isinstance(value, int) and not isinstance(value, bool):
+        label = value
+    else:
+        raise ValueError(f"Invalid feels value: {value!r}")
+    return class_labels.index(label)
 
-    data = request.json
-    print("📩 Received data:", data)
+class PipelineError(Exception):
+    pass
 
-    instances = data.get("instances", [])
-    if not instances:
-        return jsonify({"error": "No instances provided"}), 400
+def unique_rows(X):
+    """
+    Returns (unique rows, inverse) such that unique[inverse] reproduces X.
+    inverse is None when deduplication is off or X has no repeated rows.
+    """
+    if not DEDUP or len(X) == 1:
+        return X, None
+    X = np.ascontiguousarray(X)
+    # Comparing each row as one opaque byte string is several times faster than np.unique(axis=0)
+    rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel()
+    _, first_index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    if len(first_index) == len(X):
+        return X, None
+    return X[first_index], inverse.reshape(-1)
 
+def scatter_rows(values, inverse):
+    return values if inverse is None else values[inverse]
+
+def run_feels_pipeline(engine, instances):
+    """
+    Runs the upper, lower and classifier models on the unique rows of each
+    model's input and scatters the results back to the original order.
+    Returns (predictions, probabilities, dedup_ratio), where dedup_ratio is the
+    number of rows the models were given over the number they actually ran.
+    """
     raw_feature_names = [
         "t_dress", "t_poly", "t_cot", "sleeves", "j_light", "j_fleece", "j_down",
         "shorts", "p_thin", "p_thick", "p_fleece", "p_down",
@@ -120,49 +351,146 @@ def predict_feels():
     X_upper_norm = (X_upper_raw - upper_mean) / upper_scale
     X_lower_norm = (X_lower_raw - lower_mean) / lower_scale
 
-    print("🔍 Checking lower model input shapes...")
-    try:
-        upper_input_name = upper_model.get_inputs()[0].name
-        lower_input_name = lower_model.get_inputs()[0].name
-        print(f"✅ Upper Model Input: {upper_input_name}, Shape: {upper_model.get_inputs()[0].shape}")
-        print(f"✅ Lower Model Input: {lower_input_name}, Shape: {lower_model.get_inputs()[0].shape}")
-    except Exception as e:
-        print(f"❌ Model input shape retrieval error: {e}")
-        return jsonify({"error": f"Model input shape retrieval failed: {e}"}), 500
+    # Batches are dominated by a handful of standard outfits and repeated conditions
+    X_upper_unique, upper_inverse = unique_rows(X_upper_norm)
+    X_lower_unique, lower_inverse = unique_rows(X_lower_norm)
 
     try:
-        print("🚀 Running upper and lower models...")
-        upr_clo = upper_model.run(None, {upper_input_name: X_upper_norm})[0]
-        lwr_clo = lower_model.run(None, {lower_input_name: X_lower_norm})[0]
+        print(f"🚀 Running upper and lower models ({engine.name} engine)...")
+        upr_clo = scatter_rows(engine.encode_upper(X_upper_unique), upper_inverse)
+        lwr_clo = scatter_rows(engine.encode_lower(X_lower_unique), lower_inverse)
     except Exception as e:
         print(f"❌ Model execution error: {e}")
-        return jsonify({"error": f"Model execution failed: {e}"}), 500
+        raise PipelineError(f"Model execution failed: {e}")
 
     print("🔍 Combining classifier inputs...")
     X_classifier = np.concatenate([upr_clo, lwr_clo, X_rest], axis=1)
+    X_classifier_unique, classifier_inverse = unique_rows(X_classifier)
 
     print("🚀 Running classifier model...")
     try:
-        classifier_input_name = feels_model.get_inputs()[0].name
-        outputs = feels_model.run(None, {classifier_input_name: X_classifier})
-        predictions = outputs[0]
-        probabilities = outputs[1] if len(outputs) > 1 else None
+        predictions, probabilities = engine.classify(X_classifier_unique)
     except Exception as e:
         print(f"❌ Classifier model error: {e}")
-        return jsonify({"error": f"Classifier model failed: {e}"}), 500
+        raise PipelineError(f"Classifier model failed: {e}")
+
+    n_rows = len(X_raw)
+    n_unique = len(X_upper_unique) + len(X_lower_unique) + len(X_classifier_unique)
+    dedup_ratio = 3 * n_rows / n_unique
+    print(f"📉 Unique rows of {n_rows}: upper {len(X_upper_unique)}, lower {len(X_lower_unique)}, "
+          f"classifier {len(X_classifier_unique)} (dedup ratio {dedup_ratio:.2f})")
 
-    predictions = predictions.tolist() if isinstance(predictions, np.ndarray) else predictions
-    probabilities = probabilities.tolist() if isinstance(probabilities, np.ndarray) else probabilities
+    return scatter_rows(predictions, classifier_inverse), scatter_rows(probabilities, classifier_inverse), dedup_ratio
+
+@app.route('/')
+def home():
+    return 'Hello, World!'
+
+@app.route("/predict/feels", methods=["POST"])
+def predict_feels():
+    data = request.json
+    print("📩 Received data:", data)
+
+    instances = data.get("instances", [])
+    if not instances:
+        return jsonify({"error": "No instances provided"}), 400
+
+    user_id = data.get("user_id")
+    if user_id is not None and not is_valid_user_id(user_id):
+        return jsonify({"error": f"user_id must be a string or an integer of at most {MAX_USER_ID_LENGTH} characters"}), 400
+
+    engine = select_engine(len(instances))
+    if engine is None or feels_metadata is None:
+        print("❌ No feels model loaded")
+        return jsonify({"error": "No feels model loaded"}), 503
+
+    try:
+        predictions, probabilities, dedup_ratio = run_feels_pipeline(engine, instances)
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), 500
+
+    if user_id is not None and profile_store is not None:
+        offset = profile_store.get(str(user_id))
+        if offset is not None:
+            print(f"👤 Applying profile for user '{user_id}'")
+            probabilities = ProfileStore.personalize(probabilities, offset).astype(np.float32)
+            predictions = np.asarray(engine.class_labels)[np.argmax(probabilities, axis=1)]
+
+    predictions = predictions.tolist()
+    class_labels = [int(label) for label in engine.class_labels]
+    probabilities = [dict(zip(class_labels, row)) for row in probabilities.tolist()]
     prediction_label = index_to_label(predictions[0], feels_metadata)
     accuracy = feels_metadata.get("accuracy", 0.0)
 
     print("✅ Prediction:", prediction_label, "\n📊 Probabilities:", probabilities, "\n🎯 Accuracy:", accuracy)
     
-    return jsonify({
+    response = jsonify({
         "prediction": prediction_label,
         "probabilities": probabilities,
         "accuracy": accuracy
     })
+    response.headers["X-Dedup-Ratio"] = f"{dedup_ratio:.2f}"
+    return response
+
+@app.route("/feedback/feels", methods=["POST"])
+def feedback_feels():
+    data = request.json
+    print("📩 Received feedback:", data)
+
+    if profile_store is None:
+        print("❌ User profiles are disabled")
+        return jsonify({"error": "User profiles are disabled"}), 503
+
+    user_id = data.get("user_id")
+    if user_id is None:
+        return jsonify({"error": "No user_id provided"}), 400
+    if not is_valid_user_id(user_id):
+        return jsonify({"error": f"user_id must be a string or an integer of at most {MAX_USER_ID_LENGTH} characters"}), 400
+
+    instances = data.get("instances", [])
+    if not instances:
+        return jsonify({"error": "No instances provided"}), 400
+
+    engine = select_engine(len(instances))
+    if engine is None or feels_metadata is None:
+        print("❌ No feels model loaded")
+        return jsonify({"error": "No feels model loaded"}), 503
+
+    class_labels = [int(label) for label in engine.class_labels]
+    try:
+        class_indices = np.array([
+            label_to_class_index(instance["feels"], class_labels, feels_metadata) for instance in instances
+        ])
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": f"Every instance needs a 'feels' value out of {feels_metadata['class_mapping']}"}), 400
+
+    try:
+        _, probabilities, _ = run_feels_pipeline(engine, instances)
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), 500
+
+    offset = profile_store.update(str(user_id), probabilities, class_indices)
+    print(f"👤 Updated profile for user '{user_id}':", offset)
+
+    return jsonify({
+        "user_id": user_id,
+        "offsets": dict(zip(class_labels, offset.tolist()))
+    })
+
+def debug_memory():
+    return jsonify({
+        "engine": INFERENCE_ENGINE,
+        "memory_profile": MEMORY_PROFILE,
+        "max_batch_size": MAX_BATCH_SIZE,
+        "load_rss_mb": round(load_rss_mb, 2),
+        "rss_mb": round(get_rss_mb(), 2),
+        "peak_rss_mb": round(get_peak_rss_mb(), 2),
+        "sessions": session_memory,
+        "user_profiles": len(profile_store) if profile_store is not None else 0
+    })
+
+if DEBUG_ENDPOINTS:
+    app.add_url_rule("/debug/memory", view_func=debug_memory)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class NumpyEngine:
+    """
+    Evaluates the upper body encoder, the lower body PCA and the random forest
+    classifier directly in NumPy, from the flat arrays written by
+    training/export_numpy_engine.py. Avoids importing onnxruntime and the
+    per-call session overhead, which dominate small batches.
+    """
+
+    name = "numpy"
+
+    def __init__(self, arrays, max_batch_size=None):
+        self.max_batch_size = max_batch_size
+
+        n_layers = int(arrays["upper_n_layers"])
+        self.upper_weights = [arrays[f"upper_weight_{i}"] for i in range(n_layers)]
+        self.upper_biases = [arrays[f"upper_bias_{i}"] for i in range(n_layers)]
+        self.upper_relu = arrays["upper_relu"].astype(bool)
+
+        self.lower_mean = arrays["lower_mean"]
+        self.lower_components = arrays["lower_components"]
+
+        self.tree_roots = arrays["tree_roots"]
+        self.tree_features = arrays["tree_features"]
+        self.tree_thresholds = arrays["tree_thresholds"]
+        # children[2 * node] is the true branch and children[2 * node + 1] the false one,
+        # so a split is a single gather
+        self.tree_children = np.stack(
+            [arrays["tree_true_children"], arrays["tree_false_children"]], axis=1
+        ).ravel()
+        self.tree_is_leaf = arrays["tree_true_children"] == np.arange(len(self.tree_features))
+        self.tree_leaf_values = arrays["tree_leaf_values"]
+        self.tree_max_depth = int(arrays["tree_max_depth"])
+        self.class_labels = arrays["class_labels"]
+
+    @classmethod
+    def load(cls, path, max_batch_size=None):
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files}, max_batch_size)
+
+    def encode_upper(self, X):
+        out = X
+        for weight, bias, relu in zip(self.upper_weights, self.upper_biases, self.upper_relu):
+            out = out @ weight + bias
+            if relu:
+                np.maximum(out, 0, out=out)
+        return out
+
+    def encode_lower(self, X):
+        return (X - self.lower_mean) @ self.lower_components
+
+    def classify(self, X):
+        """Returns (labels, probabilities) with one probability column per class label."""
+        if self.max_batch_size and len(X) > self.max_batch_size:
+            # The traversal holds one node per (row, tree); chunking bounds that allocation
+            chunks = [self._classify(X[start:start + self.max_batch_size])
+                      for start in range(0, len(X), self.max_batch_size)]
+            return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+        return self._classify(X)
+
+    def _classify(self, X):
+        n_samples, n_features = X.shape
+        X_flat = np.ascontiguousarray(X).ravel()
+        row_offsets = (np.arange(n_samples) * n_features)[:, None]
+        # Every tree of the forest is walked at once: nodes has one column per tree.
+        # Leaves point to themselves, so walking max_depth steps lands every tree on a leaf.
+        nodes = np.broadcast_to(self.tree_roots, (n_samples, len(self.tree_roots)))
+        for step in range(self.tree_max_depth):
+            # Written as "not <=" so NaN features take the false branch, as in ONNX Runtime
+            go_false = ~(X_flat[row_offsets + self.tree_features[nodes]] <= self.tree_thresholds[nodes])
+            nodes = self.tree_children[2 * nodes + go_false]
+            # Most paths are much shorter than the deepest one
+            if step % 4 == 3 and self.tree_is_leaf[nodes].all():
+                break
+
+        probabilities = self.tree_leaf_values[nodes].sum(axis=1)
+        labels = self.class_labels[np.argmax(probabilities, axis=1)]
+        return labels, probabilities
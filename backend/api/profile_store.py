@@ -0,0 +1,169 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class ProfileStore:
+    """
+    In-memory store of per-user calibration offsets for the feels classifier.
+
+    Each user owns one row of a preallocated (capacity, n_classes) float32
+    matrix: an offset added to the log-probabilities of the global model.
+    Offsets are learned online from the user's feedback. When the store is
+    full the least recently used user is evicted and their row reused. With
+    a snapshot path set, the store is periodically written to disk and
+    reloaded on start.
+    """
+
+    # Keeps classes the forest gives no votes to reachable by an offset
+    SMOOTHING = 1e-3
+    MAX_OFFSET = 5.0
+
+    def __init__(self, n_classes, capacity=100000, learning_rate=0.5, snapshot_path=None, snapshot_interval=60):
+        if capacity < 1:
+            raise ValueError(f"Profile store capacity must be at least 1, got {capacity}")
+        self.n_classes = n_classes
+        self.capacity = capacity
+        self.learning_rate = learning_rate
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+
+        self.offsets = np.zeros((capacity, n_classes), dtype=np.float32)
+        self.slots = OrderedDict()  # user_id -> row of offsets, least recently used first
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.lock = threading.Lock()
+        # Updates made so far and how many of them the last successful snapshot holds
+        self.changes = 0
+        self.saved_changes = 0
+        self.timer = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def dirty(self):
+        return self.changes != self.saved_changes
+
+    def get(self, user_id):
+        """Returns a copy of the user's offset, or None for users without feedback."""
+        with self.lock:
+            slot = self.slots.get(user_id)
+            if slot is None:
+                return None
+            self.slots.move_to_end(user_id)
+            return self.offsets[slot].copy()
+
+    @classmethod
+    def personalize(cls, probabilities, offset):
+        """Applies a user offset to an (n_samples, n_classes) probability matrix."""
+        logits = np.log(probabilities + cls.SMOOTHING) + offset
+        logits -= logits.max(axis=1, keepdims=True)
+        adjusted = np.exp(logits)
+        return adjusted / adjusted.sum(axis=1, keepdims=True)
+
+    def update(self, user_id, probabilities, class_indices):
+        """
+        Takes one gradient step on the cross-entropy of the personalized
+        probabilities against the classes the user reported.
+
+        Parameters:
+            user_id (str): User the feedback belongs to.
+            probabilities (np.ndarray): Global model probabilities, shape (n_samples, n_classes).
+            class_indices (np.ndarray): Reported class column for each sample.
+
+        Returns:
+            np.ndarray: The user's updated offset.
+        """
+        targets = np.zeros_like(probabilities)
+        targets[np.arange(len(class_indices)), class_indices] = 1
+
+        with self.lock:
+            slot = self._slot_for(user_id)
+            personalized = self.personalize(probabilities, self.offsets[slot])
+            gradient = (personalized - targets).mean(axis=0)
+            offset = self.offsets[slot] - self.learning_rate * gradient
+            # Offsets only matter relative to each other
+            offset -= offset.mean()
+            self.offsets[slot] = np.clip(offset, -self.MAX_OFFSET, self.MAX_OFFSET)
+            self.changes += 1
+            return self.offsets[slot].copy()
+
+    def _slot_for(self, user_id):
+        slot = self.slots.get(user_id)
+        if slot is not None:
+            self.slots.move_to_end(user_id)
+            return slot
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            _, slot = self.slots.popitem(last=False)
+        self.offsets[slot] = 0
+        self.slots[user_id] = slot
+        return slot
+
+    def save(self, path=None):
+        path = path or self.snapshot_path
+        with self.lock:
+            user_ids = list(self.slots.keys())
+            offsets = self.offsets[list(self.slots.values())]
+            changes = self.changes
+
+        # Ids are stored as one UTF-8 buffer plus end offsets; a fixed-width string
+        # array would pad every id to the longest one
+        encoded = [user_id.encode("utf-8") for user_id in user_ids]
+        user_id_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        user_id_ends = np.cumsum([len(user_id) for user_id in encoded], dtype=np.int64)
+
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Write next to the snapshot and swap it in, so a crash never leaves a partial file;
+        # the temp name is unique so concurrent writers never replace each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, user_id_bytes=user_id_bytes, user_id_ends=user_id_ends, offsets=offsets)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Only now is the store saved; updates made while writing stay unsaved
+        with self.lock:
+            self.saved_changes = changes
+
+    def load(self, path=None):
+        path = path or self.snapshot_path
+        with np.load(path) as snapshot:
+            user_id_bytes = snapshot["user_id_bytes"].tobytes()
+            user_id_ends = snapshot["user_id_ends"]
+            offsets = snapshot["offsets"]
+        user_id_starts = np.concatenate([[0], user_id_ends[:-1]])
+        user_ids = [user_id_bytes[start:end].decode("utf-8") for start, end in zip(user_id_starts, user_id_ends)]
+
+        if offsets.shape[1:] != (self.n_classes,):
+            raise ValueError(f"Snapshot has {offsets.shape[1:]} classes, expected {self.n_classes}")
+
+        with self.lock:
+            # Snapshots are written least recently used first; keep the most recent users
+            for user_id, offset in zip(user_ids[-self.capacity:], offsets[-self.capacity:]):
+                self.offsets[self._slot_for(user_id)] = offset
+            self.saved_changes = self.changes
+
+    def start_snapshots(self):
+        """Saves the store every snapshot_interval seconds while it has unsaved changes."""
+        def snapshot():
+            if self.dirty:
+                try:
+                    self.save()
+                    print(f"✅ Saved {len(self)} user profiles to {self.snapshot_path}")
+                except Exception as e:
+                    print(f"❌ Error saving user profiles to '{self.snapshot_path}': {e}")
+            self.start_snapshots()
+
+        self.timer = threading.Timer(self.snapshot_interval, snapshot)
+        self.timer.daemon = True
+        self.timer.start()
@@ -0,0 +1,70 @@
+"""
+Reports the memory footprint of the serving process: RSS after the models are
+loaded, the RSS growth of each ONNX session, and RSS after a large batch.
+
+Usage:
+    python3 tools/memory_report.py [--batch-size 5000]
+
+Set TEMPFEEL_ENGINE / TEMPFEEL_MEMORY_PROFILE / TEMPFEEL_MAX_BATCH_SIZE to compare setups.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import contextlib
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../api")
+sys.path.insert(0, API_DIR)
+# The report reads /debug/memory, which the app only registers on request
+os.environ["TEMPFEEL_DEBUG_ENDPOINTS"] = "1"
+
+CLOTHING_FEATURES = [
+    "t_dress", "t_poly", "t_cot", "sleeves", "j_light", "j_fleece", "j_down",
+    "shorts", "p_thin", "p_thick", "p_fleece", "p_down"
+]
+
+def make_instances(batch_size, seed=42):
+    """Random instances with continuous temp, headwind and hr, so deduplication cannot shrink the batch."""
+    rng = random.Random(seed)
+    instances = []
+    for _ in range(batch_size):
+        instance = {feature: rng.randint(0, 1) for feature in CLOTHING_FEATURES}
+        instance.update(
+            temp=rng.uniform(-25, 40), sun=rng.randint(0, 1), headwind=rng.uniform(0, 30),
+            snow=rng.randint(0, 3), rain=rng.randint(0, 3), fatigued=rng.randint(0, 1), hr=rng.uniform(50, 190)
+        )
+        instances.append(instance)
+    return instances
+
+def main():
+    parser = argparse.ArgumentParser(description="Report serving process memory usage")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Number of instances in the large batch")
+    args = parser.parse_args()
+
+    # The app logs every request verbosely; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import app as server
+        client = server.app.test_client()
+        after_load = client.get("/debug/memory").get_json()
+
+        response = client.post("/predict/feels", json={"instances": make_instances(args.batch_size)})
+        after_batch = client.get("/debug/memory").get_json()
+
+    if response.status_code != 200:
+        print(f"❌ Batch prediction failed ({response.status_code}): {response.get_json()}")
+        sys.exit(1)
+
+    print(f"📦 Engine: {after_load['engine']}, memory profile: {after_load['memory_profile']} "
+          f"(max batch size {after_load['max_batch_size']})")
+    print(f"📊 RSS after load: {after_load['rss_mb']:.1f} MB")
+    for name, stats in after_load["sessions"].items():
+        print(f"   {name}: +{stats['load_mb']:.1f} MB")
+    print(f"📊 RSS after batch of {args.batch_size}: {after_batch['rss_mb']:.1f} MB "
+          f"(peak {after_batch['peak_rss_mb']:.1f} MB, dedup ratio {response.headers.get('X-Dedup-Ratio')})")
+    for name, stats in after_batch["sessions"].items():
+        print(f"   {name}: +{stats.get('run_mb', 0.0):.1f} MB during its largest run")
+    print(json.dumps({"after_load": after_load, "after_batch": after_batch}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import onnx
+from onnx import helper, numpy_helper
+import onnxruntime as ort
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "../api"))
+from numpy_engine import NumpyEngine
+
+UPPER_FEATURES = ["t_dress", "t_poly", "t_cot", "sleeves", "j_light", "j_fleece", "j_down"]
+LOWER_FEATURES = ["shorts", "p_thin", "p_thick", "p_fleece", "p_down"]
+REST_FEATURES = ["temp", "sun", "headwind", "snow", "rain", "fatigued", "hr"]
+
+
+def extract_dense_layers(model_path):
+    """Reads the MatMul/Add/Relu chain of the upper body encoder into per-layer arrays."""
+    model = onnx.load(model_path)
+    initializers = {init.name: numpy_helper.to_array(init) for init in model.graph.initializer}
+
+    weights, biases, relu = [], [], []
+    for node in model.graph.node:
+        if node.op_type == "MatMul":
+            weights.append(initializers[node.input[1]].astype(np.float32))
+            biases.append(np.zeros(weights[-1].shape[1], dtype=np.float32))
+            relu.append(False)
+        elif node.op_type == "Add" and weights:
+            biases[-1] = initializers[node.input[1]].astype(np.float32)
+        elif node.op_type == "Relu" and weights:
+            relu[-1] = True
+        else:
+            raise ValueError(f"Unsupported op '{node.op_type}' in {model_path}")
+
+    arrays = {"upper_n_layers": np.array(len(weights)), "upper_relu": np.array(relu)}
+    for i, (weight, bias) in enumerate(zip(weights, biases)):
+        arrays[f"upper_weight_{i}"] = weight
+        arrays[f"upper_bias_{i}"] = bias
+    return arrays
+
+
+def extract_pca(model_path):
+    """Reads the mean and projection matrix of the lower body PCA."""
+    model = onnx.load(model_path)
+    initializers = {init.name: numpy_helper.to_array(init) for init in model.graph.initializer}
+    ops = [node.op_type for node in model.graph.node]
+    if ops != ["Sub", "MatMul"]:
+        raise ValueError(f"Unsupported PCA graph {ops} in {model_path}")
+
+    sub, matmul = model.graph.node
+    return {
+        "lower_mean": initializers[sub.input[1]].astype(np.float32),
+        "lower_components": initializers[matmul.input[1]].astype(np.float32),
+    }
+
+
+def extract_forest(model_path):
+    """Flattens the TreeEnsembleClassifier into node arrays shared by all trees."""
+    model = onnx.load(model_path)
+    tree_nodes = [node for node in model.graph.node if node.op_type == "TreeEnsembleClassifier"]
+    if len(tree_nodes) != 1:
+        raise ValueError(f"Expected one TreeEnsembleClassifier in {model_path}")
+    attrs = {a.name: helper.get_attribute_value(a) for a in tree_nodes[0].attribute}
+
+    if attrs.get("post_transform", b"NONE") != b"NONE":
+        raise ValueError(f"Unsupported post_transform {attrs['post_transform']} in {model_path}")
+
+    tree_ids = np.array(attrs["nodes_treeids"])
+    node_ids = np.array(attrs["nodes_nodeids"])
+    modes = attrs["nodes_modes"]
+    if any(mode not in (b"BRANCH_LEQ", b"LEAF") for mode in modes):
+        raise ValueError(f"Only BRANCH_LEQ splits are supported in {model_path}")
+    # The engine always sends NaN down the false branch
+    if any(attrs.get("nodes_missing_value_tracks_true", [])):
+        raise ValueError(f"nodes_missing_value_tracks_true is not supported in {model_path}")
+
+    # Global node index = offset of the tree + node id within the tree
+    n_trees = tree_ids.max() + 1
+    tree_sizes = np.bincount(tree_ids, minlength=n_trees)
+    offsets = np.concatenate([[0], np.cumsum(tree_sizes)[:-1]])
+    n_nodes = tree_sizes.sum()
+    index = offsets[tree_ids] + node_ids
+
+    is_leaf = np.zeros(n_nodes, dtype=bool)
+    is_leaf[index] = [mode == b"LEAF" for mode in modes]
+
+    features = np.zeros(n_nodes, dtype=np.int32)
+    thresholds = np.zeros(n_nodes, dtype=np.float32)
+    true_children = np.zeros(n_nodes, dtype=np.int32)
+    false_children = np.zeros(n_nodes, dtype=np.int32)
+    features[index] = attrs["nodes_featureids"]
+    thresholds[index] = attrs["nodes_values"]
+    true_children[index] = offsets[tree_ids] + np.array(attrs["nodes_truenodeids"])
+    false_children[index] = offsets[tree_ids] + np.array(attrs["nodes_falsenodeids"])
+
+    # Leaves loop back onto themselves so the traversal can run a fixed number of steps
+    leaves = np.flatnonzero(is_leaf)
+    features[leaves] = 0
+    thresholds[leaves] = 0
+    true_children[leaves] = leaves
+    false_children[leaves] = leaves
+
+    class_labels = np.array(attrs["classlabels_int64s"], dtype=np.int64)
+    class_positions = {label: i for i, label in enumerate(class_labels)}
+    leaf_values = np.zeros((n_nodes, len(class_labels)), dtype=np.float32)
+    class_index = offsets[np.array(attrs["class_treeids"])] + np.array(attrs["class_nodeids"])
+    class_columns = [class_positions[class_id] for class_id in attrs["class_ids"]]
+    np.add.at(leaf_values, (class_index, class_columns), np.array(attrs["class_weights"], dtype=np.float32))
+
+    roots = offsets.astype(np.int32)
+    frontier = roots
+    max_depth = 0
+    while True:
+        frontier = frontier[~is_leaf[frontier]]
+        if len(frontier) == 0:
+            break
+        max_depth += 1
+        frontier = np.concatenate([true_children[frontier], false_children[frontier]])
+
+    return {
+        "tree_roots": roots,
+        "tree_features": features,
+        "tree_thresholds": thresholds,
+        "tree_true_children": true_children,
+        "tree_false_children": false_children,
+        "tree_leaf_values": leaf_values,
+        "tree_max_depth": np.array(max_depth),
+        "class_labels": class_labels,
+    }
+
+
+def verify_against_onnx(engine, models_dir, input_csv_path, n_random=2000, seed=42):
+    """Runs the training data and random inputs through both engines and checks they agree."""
+    data = pd.read_csv(input_csv_path)
+    rng = np.random.default_rng(seed)
+
+    with np.load(os.path.join(models_dir, "scaler_upper.npz")) as scaler:
+        upper_mean, upper_scale = scaler["mean"].astype(np.float32), scaler["scale"].astype(np.float32)
+    with np.load(os.path.join(models_dir, "scaler_lower.npz")) as scaler:
+        lower_mean, lower_scale = scaler["mean"].astype(np.float32), scaler["scale"].astype(np.float32)
+
+    X_upper = np.concatenate([
+        data[UPPER_FEATURES].to_numpy(np.float32),
+        rng.integers(0, 2, size=(n_random, len(UPPER_FEATURES))).astype(np.float32),
+    ])
+    X_lower = np.concatenate([
+        data[LOWER_FEATURES].to_numpy(np.float32),
+        rng.integers(0, 2, size=(n_random, len(LOWER_FEATURES))).astype(np.float32),
+    ])
+    X_rest = np.concatenate([
+        data[REST_FEATURES].to_numpy(np.float32),
+        np.column_stack([
+            rng.uniform(-25, 40, n_random), rng.integers(0, 2, n_random), rng.uniform(0, 30, n_random),
+            rng.integers(0, 4, n_random), rng.integers(0, 4, n_random), rng.integers(0, 2, n_random),
+            rng.uniform(50, 190, n_random),
+        ]).astype(np.float32),
+    ])
+    X_upper_norm = (X_upper - upper_mean) / upper_scale
+    X_lower_norm = (X_lower - lower_mean) / lower_scale
+
+    upper_session = ort.InferenceSession(os.path.join(models_dir, "encoder_upper.onnx"), providers=["CPUExecutionProvider"])
+    lower_session = ort.InferenceSession(os.path.join(models_dir, "pca_lower.onnx"), providers=["CPUExecutionProvider"])
+    feels_session = ort.InferenceSession(os.path.join(models_dir, "feels/model.onnx"), providers=["CPUExecutionProvider"])
+
+    upr_clo_ort = upper_session.run(None, {upper_session.get_inputs()[0].name: X_upper_norm})[0]
+    lwr_clo_ort = lower_session.run(None, {lower_session.get_inputs()[0].name: X_lower_norm})[0]
+    upr_clo_np = engine.encode_upper(X_upper_norm)
+    lwr_clo_np = engine.encode_lower(X_lower_norm)
+
+    labels_ort, zipmap_ort = feels_session.run(
+        None, {feels_session.get_inputs()[0].name: np.concatenate([upr_clo_ort, lwr_clo_ort, X_rest], axis=1)}
+    )
+    probabilities_ort = np.array([[row[label] for label in engine.class_labels] for row in zipmap_ort], dtype=np.float32)
+
+    # Forest alone: classify ORT's encoder outputs so differences are not masked by encoder rounding
+    labels_forest, probabilities_forest = engine.classify(np.concatenate([upr_clo_ort, lwr_clo_ort, X_rest], axis=1))
+    # End to end: the path the API runs, encoders and forest all in NumPy
+    labels_np, probabilities_np = engine.classify(np.concatenate([upr_clo_np, lwr_clo_np, X_rest], axis=1))
+
+    diffs = {
+        "upr_clo": float(np.max(np.abs(upr_clo_ort - upr_clo_np))),
+        "lwr_clo": float(np.max(np.abs(lwr_clo_ort - lwr_clo_np))),
+        "forest probability": float(np.max(np.abs(probabilities_ort - probabilities_forest))),
+        "end-to-end probability": float(np.max(np.abs(probabilities_ort - probabilities_np))),
+    }
+    mismatches = {
+        "forest label": int(np.sum(labels_ort != labels_forest)),
+        "end-to-end label": int(np.sum(labels_ort != labels_np)),
+    }
+
+    print(f"🔬 Checked {len(X_rest)} samples against ONNX Runtime")
+    for name, diff in diffs.items():
+        print(f"   {name} max abs diff: {diff:.2e}")
+    for name, count in mismatches.items():
+        print(f"   {name} mismatches: {count}")
+
+    if max(diffs.values()) > 1e-5 or any(mismatches.values()):
+        raise RuntimeError("❌ NumPy engine output does not match ONNX Runtime")
+    print("✅ NumPy engine matches ONNX Runtime")
+
+
+def export_numpy_engine(models_dir, output_path, input_csv_path):
+    """
+    Flattens the exported ONNX models into NumPy arrays for the pure-NumPy
+    inference engine and verifies the result against ONNX Runtime.
+
+    Parameters:
+        models_dir (str): Directory holding encoder_upper.onnx, pca_lower.onnx, feels/model.onnx and the scalers.
+        output_path (str): Path of the .npz archive read by api/numpy_engine.py.
+        input_csv_path (str): Cleaned dataset used as verification input.
+    """
+    arrays = {}
+    arrays.update(extract_dense_layers(os.path.join(models_dir, "encoder_upper.onnx")))
+    arrays.update(extract_pca(os.path.join(models_dir, "pca_lower.onnx")))
+    arrays.update(extract_forest(os.path.join(models_dir, "feels/model.onnx")))
+
+    np.savez(output_path, **arrays)
+    print(f"✅ Saved NumPy engine arrays to {output_path}")
+
+    verify_against_onnx(NumpyEngine.load(output_path), models_dir, input_csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or check the NumPy inference engine arrays")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check the existing numpy_engine.npz against the ONNX models, without exporting")
+    args = parser.parse_args()
+
+    models_directory = os.path.join(BASE_DIR, "../models")
+    output_path = os.path.join(models_directory, "numpy_engine.npz")
+    input_csv_path = os.path.join(BASE_DIR, "../data/cleaned_data.csv")
+
+    if args.check:
+        verify_against_onnx(NumpyEngine.load(output_path), models_directory, input_csv_path)
+    else:
+        export_numpy_engine(models_directory, output_path, input_csv_path)
+
+if __name__ == "__main__":
+    main()
@@ -161,4 +161,13 @@ if __name__ == "__main__":
         parse_cleaned_data.main()
 
     # Train all models
-    train_feels_model()
\ No newline at end of file
+    train_feels_model()
+
+    # Flatten the exported ONNX models for the pure-NumPy inference engine
+    import export_numpy_engine
+    models_dir = os.path.join(BASE_DIR, "../models")
+    export_numpy_engine.export_numpy_engine(
+        models_dir=models_dir,
+        output_path=os.path.join(models_dir, "numpy_engine.npz"),
+        input_csv_path=os.path.join(BASE_DIR, "../data/cleaned_data.csv"),
+    )
\ No newline at end of file